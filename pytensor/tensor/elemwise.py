@@ -16,6 +16,7 @@ from pytensor.misc.frozendict import frozendict
 from pytensor.misc.safe_asarray import _asarray
 from pytensor.printing import Printer, pprint
 from pytensor.scalar import get_scalar_type
+from pytensor.scalar.basic import Add, Mul, Sub, TrueDiv
 from pytensor.scalar.basic import bool as scalar_bool
 from pytensor.scalar.basic import identity as scalar_identity
 from pytensor.scalar.basic import transfer_type, upcast
@@ -315,6 +316,11 @@ class DimShufflePrinter(Printer):
 pprint.assign(DimShuffle, DimShufflePrinter())
 
 
+# The operations of `elemwise_cgen.SIMD_REGISTERS` implementing binary scalar
+# `Op`s
+_simd_op_names = {Add: "add", Sub: "sub", Mul: "mul", TrueDiv: "div"}
+
+
 class Elemwise(OpenMPOp):
     """Generalizes a scalar `Op` to tensors.
 
@@ -884,21 +890,6 @@ class Elemwise(OpenMPOp):
         decl = cgen.make_declare(orders, idtypes, sub)
         checks = cgen.make_checks(orders, idtypes, sub)
 
-        # Check if all inputs (except broadcasted scalar) are fortran.
-        # In that case, create a fortran output ndarray.
-        z = list(zip(inames, inputs))
-        alloc_fortran = " && ".join(
-            [
-                f"PyArray_ISFORTRAN({arr})"
-                for arr, var in z
-                if not all(s == 1 for s in var.type.shape)
-            ]
-        )
-        # If it is a scalar, make it c contig to prevent problem with
-        # NumPy C and F contig not always set as both of them.
-        if len(alloc_fortran) == 0:
-            alloc_fortran = "0"
-
         alloc = ""
         # We loop over the "real" outputs, i.e., those that are not
         # inplace (must be allocated) and we declare/allocate/check
@@ -910,7 +901,9 @@ class Elemwise(OpenMPOp):
             alloc += cgen.make_declare(
                 [list(range(nnested))], [odtype], dict(sub, lv0=oname)
             )
-            alloc += cgen.make_alloc(orders, odtype, sub, fortran=alloc_fortran)
+            # If all inputs (except broadcasted scalar) are fortran,
+            # a fortran output ndarray is created.
+            alloc += cgen.make_alloc(orders, odtype, sub, fortran=None)
             alloc += cgen.make_checks(
                 [list(range(nnested))], [odtype], dict(sub, lv0=oname)
             )
@@ -971,6 +964,90 @@ class Elemwise(OpenMPOp):
 
         loop_orders = orders + [list(range(nnested))] * len(real_onames)
         dtypes = idtypes + list(real_odtypes)
+        # The inputs that are not overwritten by an inplace output
+        destroyed = [dmap[o][0] for o in aliased_outputs]
+        read_only = [i for i, inp in enumerate(inputs) if inp not in destroyed]
+        simd_task = self._c_simd_task(node)
+        contig = None
+        # If all inputs and outputs are contiguous
+        # and the scalar op define optimized code for that case
+        # use it! The scalar_op needs to check the type-level shapes itself.
+        if (
+            all(o.ndim >= 1 for o in node.outputs)
+            and
+            # Don't use the contig code for broadcasted scalar.
+            not all(s == 1 for s in node.outputs[0].type.shape)
+        ):
+            try:
+                contig = self.scalar_op.c_code_contiguous(
+                    node, nodename + "_scalar_contig_", _inames, onames, sub
+                )
+            except MethodNotDefined:
+                # Try to make one generic version, this will help the
+                # compiler to vectorize the code as their won't be as
+                # many ptr and the stride will be hard coded.
+                # The flat SIMD loop of make_loop replaces it when there is one.
+                if (
+                    simd_task is None
+                    and all(
+                        # io.type.shape == node.outputs[1].type.shape
+                        # Elemwise does not specify non-broadcastable static/type-levelshape
+                        # information for its outputs yet
+                        node.outputs[0].type.is_super(io.type)
+                        for io in node.inputs + node.outputs
+                    )
+                    and (
+                        len(node.inputs) <= 1
+                        # If either one of the inputs has a `None` shape, we cannot
+                        # assume they will have the same size
+                        or all(
+                            len(set(inp_shape)) == 1 and None not in inp_shape
+                            for inp_shape in zip(
+                                *(inp.type.shape for inp in node.inputs)
+                            )
+                        )
+                    )
+                ):
+                    z = onames[0]
+                    contig = f"""
+                    // All output have the same size
+                    npy_intp n = PyArray_SIZE({z});
+                    """
+                    index = ""
+                    for x, var in zip(inames + onames, inputs + node.outputs):
+                        if not all(s == 1 for s in var.type.shape):
+                            contig += (
+                                """
+            dtype_%(x)s * %(x)s_ptr = (dtype_%(x)s*) PyArray_DATA(%(x)s);
+                            """
+                                % locals()
+                            )
+                            index += (
+                                """
+            dtype_%(x)s& %(x)s_i = %(x)s_ptr[i];
+                            """
+                                % locals()
+                            )
+                        else:
+                            contig += (
+                                """
+            dtype_%(x)s& %(x)s_i = ((dtype_%(x)s*) PyArray_DATA(%(x)s))[0];
+                            """
+                                % locals()
+                            )
+                    if self.openmp:
+                        contig += f"""#pragma omp parallel for if(n>={int(config.openmp_elemwise_minsize)})
+                        """
+                    contig += (
+                        """
+                    for(int i=0; i<n; i++){
+                        %(index)s
+                        %(task_code)s;
+                    }
+                    """
+                        % locals()
+                    )
+
         if all(
             [o.ndim <= 1 for o in node.outputs]
             or
@@ -1030,6 +1107,11 @@ class Elemwise(OpenMPOp):
                     loop_tasks=all_code,
                     sub=sub,
                     openmp=self.openmp,
+                    simd_task=simd_task,
+                    read_only=read_only,
+                    static_shape=node.outputs[0].type.shape,
+                    # The contig code already handles contiguous arrays
+                    contiguous_loop=contig is None,
                 )
         else:
             loop = cgen.make_reordered_loop(
@@ -1039,107 +1121,37 @@ class Elemwise(OpenMPOp):
                 inner_task=code,
                 sub=sub,
                 openmp=self.openmp,
+                read_only=read_only,
+                static_shape=node.outputs[0].type.shape,
             )
 
-        # If all inputs and outputs are contiguous
-        # and the scalar op define optimized code for that case
-        # use it! The scalar_op needs to check the type-level shapes itself.
-        if (
-            all(o.ndim >= 1 for o in node.outputs)
-            and
-            # Don't use the contig code for broadcasted scalar.
-            not all(s == 1 for s in node.outputs[0].type.shape)
-        ):
-            contig = None
-            try:
-                contig = self.scalar_op.c_code_contiguous(
-                    node, nodename + "_scalar_contig_", _inames, onames, sub
-                )
-            except MethodNotDefined:
-                # Try to make one generic version, this will help the
-                # compiler to vectorize the code as their won't be as
-                # many ptr and the stride will be hard coded.
-                if all(
-                    # io.type.shape == node.outputs[1].type.shape
-                    # Elemwise does not specify non-broadcastable static/type-levelshape
-                    # information for its outputs yet
-                    node.outputs[0].type.is_super(io.type)
-                    for io in node.inputs + node.outputs
-                ) and (
-                    len(node.inputs) <= 1
-                    # If either one of the inputs has a `None` shape, we cannot
-                    # assume they will have the same size
-                    or all(
-                        len(set(inp_shape)) == 1 and None not in inp_shape
-                        for inp_shape in zip(*(inp.type.shape for inp in node.inputs))
-                    )
-                ):
-                    z = onames[0]
-                    contig = f"""
-                    // All output have the same size
-                    npy_intp n = PyArray_SIZE({z});
-                    """
-                    index = ""
-                    for x, var in zip(inames + onames, inputs + node.outputs):
-                        if not all(s == 1 for s in var.type.shape):
-                            contig += (
-                                """
-            dtype_%(x)s * %(x)s_ptr = (dtype_%(x)s*) PyArray_DATA(%(x)s);
-                            """
-                                % locals()
-                            )
-                            index += (
-                                """
-            dtype_%(x)s& %(x)s_i = %(x)s_ptr[i];
-                            """
-                                % locals()
-                            )
-                        else:
-                            contig += (
-                                """
-            dtype_%(x)s& %(x)s_i = ((dtype_%(x)s*) PyArray_DATA(%(x)s))[0];
-                            """
-                                % locals()
-                            )
-                    if self.openmp:
-                        contig += f"""#pragma omp parallel for if(n>={int(config.openmp_elemwise_minsize)})
-                        """
-                    contig += (
-                        """
-                    for(int i=0; i<n; i++){
-                        %(index)s
-                        %(task_code)s;
-                    }
-                    """
-                        % locals()
-                    )
-            if contig is not None:
-                z = list(zip(inames + onames, inputs + node.outputs))
-                all_broadcastable = all(s == 1 for s in var.type.shape)
-                cond1 = " && ".join(
-                    [
-                        "PyArray_ISCONTIGUOUS(%s)" % arr
-                        for arr, var in z
-                        if not all_broadcastable
-                    ]
-                )
-                cond2 = " && ".join(
-                    [
-                        "PyArray_ISFORTRAN(%s)" % arr
-                        for arr, var in z
-                        if not all_broadcastable
-                    ]
-                )
-                loop = (
-                    """
-            if((%(cond1)s) || (%(cond2)s)){
-                %(contig)s
-            }else{
-                %(loop)s
-            }
-            """
-                    % locals()
-                )
+        if contig is not None:
+            z = list(zip(inames + onames, inputs + node.outputs))
+            all_broadcastable = all(s == 1 for s in var.type.shape)
+            cond1 = " && ".join(
+                [
+                    "PyArray_ISCONTIGUOUS(%s)" % arr
+                    for arr, var in z
+                    if not all_broadcastable
+                ]
+            )
+            cond2 = " && ".join(
+                [
+                    "PyArray_ISFORTRAN(%s)" % arr
+                    for arr, var in z
+                    if not all_broadcastable
+                ]
+            )
+            loop = (
+                """
+        if((%(cond1)s) || (%(cond2)s)){
+            %(contig)s
+        }else{
+            %(loop)s
+        }
+        """
+                % locals()
+            )
         return decl, checks, alloc, loop, ""
 
     def c_code(self, node, nodename, inames, onames, sub):
@@ -1166,10 +1178,34 @@ class Elemwise(OpenMPOp):
 
     def c_support_code_apply(self, node, nodename):
         support_code = self.scalar_op.c_support_code_apply(node, nodename + "_scalar_")
+        if self._c_simd_task(node):
+            support_code = cgen.simd_support_code + support_code
         return support_code
 
+    def _c_simd_task(self, node):
+        """Return the `simd_task` of the loop of `node`, see `cgen.make_loop`.
+
+        Only the loops over a single dimension of binary scalar `Op`s, with
+        distinct inputs and an output of the same dtype that is not computed
+        inplace, have one.
+
+        """
+        if (
+            type(self.scalar_op) not in _simd_op_names
+            or len(node.inputs) != 2
+            or node.inputs[0] is node.inputs[1]
+            or self.inplace_pattern
+            or node.outputs[0].type.ndim != 1
+            or len({var.type.dtype for var in node.inputs + node.outputs}) != 1
+        ):
+            return None
+        return cgen.make_simd_task(
+            _simd_op_names[type(self.scalar_op)],
+            node.outputs[0].type.dtype_specs()[1],
+        )
+
     def c_code_cache_version_apply(self, node):
-        version = [15]  # the version corresponding to the c code in this Op
+        version = [34]  # the version corresponding to the c code in this Op
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -1188,6 +1224,8 @@ class Elemwise(OpenMPOp):
             version.append(get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
         version.append(("openmp", self.openmp))
         version.append(("openmp_elemwise_minsize", config.openmp_elemwise_minsize))
+        # The loops are specialized to the static shape of the outputs
+        version.append(("static_shape", node.outputs[0].type.shape))
         if all(version):
             return tuple(version)
         else:
@@ -1662,7 +1700,7 @@ class CAReduce(COp):
 
     def c_code_cache_version_apply(self, node):
         # the version corresponding to the c code in this Op
-        version = [9]
+        version = [14]
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
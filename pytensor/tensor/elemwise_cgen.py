@@ -1,45 +1,336 @@
+import re
+from functools import lru_cache
+from math import prod
+
 from pytensor.configdefaults import config
 
 
+# The emitters below are pure functions of their arguments, and are called
+# with the same ones by isomorphic ops. The C code they generate is cached by
+# `_make_*_cached` functions, which take hashable arguments. The names of the
+# variables and the failure code, which differ from a node to another, are
+# replaced by placeholders in the cached code.
+_CACHE_SIZE = 512
+_SUB_KEY = re.compile(r"lv\d+|olv|fail")
+_PLACEHOLDER = re.compile("\x00(\\w+)\x00")
+
+
+def _freeze(value):
+    """Convert the lists of `value` to tuples, recursively, to make it hashable."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def _sub_key(sub):
+    """Return the placeholders of the items of `sub` used by the emitters."""
+    return tuple((k, f"\x00{k}\x00") for k in sorted(sub) if _SUB_KEY.fullmatch(k))
+
+
+def _substitute(code, sub):
+    """Replace the placeholders of `_sub_key` in `code` by the items of `sub`."""
+    return _PLACEHOLDER.sub(lambda match: sub[match[1]], code)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _placeholders_pattern(sub_items):
+    # The names of the variables are only matched where they are not part of
+    # a longer identifier, like in `{name}_i`, the failure code anywhere.
+    patterns = [
+        re.escape(v) if k == "fail" else rf"(?<!\w){re.escape(v)}(?![^\W_])"
+        for k, v in sorted(sub_items, key=lambda item: -len(item[1]))
+    ]
+    return re.compile("|".join(patterns))
+
+
+def _normalize(tasks, sub):
+    """Replace the items of `sub` used by the emitters by their placeholders.
+
+    `tasks` is a string, or nested tuples of strings. The tasks get back
+    their original code from `_substitute`.
+
+    """
+    sub_items = tuple(
+        sorted((k, v) for k, v in sub.items() if _SUB_KEY.fullmatch(k) and v)
+    )
+    if not sub_items:
+        return tasks
+    pattern = _placeholders_pattern(sub_items)
+    placeholders = {}
+    for k, v in sub_items:
+        placeholders.setdefault(v, f"\x00{k}\x00")
+
+    def normalize(value):
+        if isinstance(value, tuple):
+            return tuple(normalize(v) for v in value)
+        return pattern.sub(lambda match: placeholders[match[0]], value)
+
+    return normalize(tasks)
+
+
+def _simd_register(lanes, macro, vtype, prefix, suffix, ops):
+    return dict(
+        lanes=lanes,
+        macro=macro,
+        vtype=vtype,
+        load=f"{prefix}_loadu_{suffix}({{}})",
+        store=f"{prefix}_storeu_{suffix}({{}}, {{}})",
+        set1=f"{prefix}_set1_{suffix}({{}})",
+        ops={op: f"{prefix}_{name}_{suffix}" for op, name in ops.items()},
+    )
+
+
+def _simd_int_register(bits, element_bits, macro, ops):
+    # The integer intrinsics share the same loads and stores for all the
+    # sizes of elements, which take pointers to the whole register.
+    register = _simd_register(
+        bits // element_bits,
+        macro,
+        f"__m{bits}i",
+        f"_mm{bits}",
+        f"epi{element_bits}",
+        ops,
+    )
+    register["load"] = f"_mm{bits}_loadu_si{bits}((__m{bits}i const*)({{}}))"
+    register["store"] = f"_mm{bits}_storeu_si{bits}((__m{bits}i*)({{}}), {{}})"
+    if bits == 256 and element_bits == 64:
+        register["set1"] = "_mm256_set1_epi64x({})"
+    return register
+
+
+# The SIMD registers that can be used by `make_contiguous_loop`, for each C
+# dtype, from the widest to the narrowest. `macro` is the preprocessor macro
+# telling if the instructions are available, and `ops` maps the names
+# accepted by `make_simd_task` to the intrinsics implementing them.
+_float_simd_ops = {"add": "add", "sub": "sub", "mul": "mul", "div": "div"}
+# The integer additions, subtractions and multiplications wrap around like
+# the ones of NumPy. There is no multiplication of 8 or 64 bits integers
+# before AVX-512DQ, and no division at all.
+_int_simd_ops = {"add": "add", "sub": "sub"}
+_int_mul_simd_ops = {"add": "add", "sub": "sub", "mul": "mullo"}
+SIMD_REGISTERS = {
+    "npy_float32": [
+        _simd_register(16, "__AVX512F__", "__m512", "_mm512", "ps", _float_simd_ops),
+        _simd_register(8, "__AVX__", "__m256", "_mm256", "ps", _float_simd_ops),
+    ],
+    "npy_float64": [
+        _simd_register(8, "__AVX512F__", "__m512d", "_mm512", "pd", _float_simd_ops),
+        _simd_register(4, "__AVX__", "__m256d", "_mm256", "pd", _float_simd_ops),
+    ],
+}
+# Signed and unsigned integers are the same for wrapping operations
+SIMD_REGISTERS.update(
+    {
+        dtype: [
+            _simd_int_register(512, bits, macro_512, ops),
+            _simd_int_register(256, bits, "__AVX2__", ops),
+        ]
+        for bits, macro_512, ops in [
+            (8, "__AVX512BW__", _int_simd_ops),
+            (16, "__AVX512BW__", _int_mul_simd_ops),
+            (32, "__AVX512F__", _int_mul_simd_ops),
+            (64, "__AVX512F__", _int_simd_ops),
+        ]
+        for dtype in [f"npy_int{bits}", f"npy_uint{bits}"]
+    }
+)
+
+
+# The header declaring the intrinsics of `SIMD_REGISTERS`
+simd_support_code = """
+#if defined(__AVX__)
+#include <immintrin.h>
+#endif
+"""
+
+
+def make_simd_task(op_name, dtype):
+    """Return the `simd_task` of `make_loop` for an operation on a C dtype.
+
+    Returns None if no SIMD instruction is known for this operation and dtype.
+
+    """
+    simd_task = [
+        (register["ops"][op_name], register["lanes"])
+        for register in SIMD_REGISTERS.get(dtype, [])
+        if op_name in register["ops"]
+    ]
+    return simd_task or None
+
+
+# Skeletons of the code emitted for every variable and dimension by
+# `make_declare` and `make_checks`, filled with `str.format_map`.
+_DECLARE_ITER = """
+{dtype}* __restrict__ {var}_iter;
+"""
+
+_DECLARE_DIM = """
+npy_intp {var}_n{index};
+ssize_t {var}_stride{index};
+int {var}_jump{index}_{loop};
+"""
+
+_DECLARE_BROADCAST_DIM = """
+int {var}_jump{index}_{loop};
+"""
+
+_CHECK_NDIM = """
+if (PyArray_NDIM({var}) < {min_nd}) {{
+    PyErr_SetString(PyExc_ValueError, "Not enough dimensions on input.");
+    {fail}
+}}
+"""
+
+_INIT_DIM = """
+{var}_n{index} = PyArray_DIMS({var})[{index}];
+{var}_stride{index} = PyArray_STRIDES({var})[{index}] / sizeof({dtype});
+{mask}
+{var}_jump{index}_{loop} = {jump};
+"""
+
+# A dimension of length 1 doesn't move the pointer, so that it is broadcasted
+_MASK_BROADCAST_STRIDE = """
+{var}_stride{index} *= ({var}_n{index} != 1);
+"""
+
+_INIT_BROADCAST_DIM = """
+{var}_jump{index}_{loop} = {jump};
+"""
+
+_RUNTIME_BROADCAST_ERROR_MSG = (
+    "Runtime broadcasting not allowed. "
+    "One input had a distinct dimension length of 1, but was not marked as broadcastable: "
+    "(input[%i].shape[%i] = %lld, input[%i].shape[%i] = %lld). "
+    "If broadcasting was intended, use `specify_broadcastable` on the relevant input."
+)
+
+_DIM_MISMATCH = (
+    """
+if ({var0}_n{x0} != {var}_n{x})
+{{
+    if ({var0}_n{x0} == 1 || {var}_n{x} == 1)
+    {{
+        PyErr_Format(PyExc_ValueError, "%s",
+            {j0},
+            {x0},
+            (long long int) {var0}_n{x0},
+            {j},
+            {x},
+            (long long int) {var}_n{x}
+        );
+    }} else {{
+        PyErr_Format(PyExc_ValueError, "Input dimension mismatch: (input[%%i].shape[%%i] = %%lld, input[%%i].shape[%%i] = %%lld)",
+            {j0},
+            {x0},
+            (long long int) {var0}_n{x0},
+            {j},
+            {x},
+            (long long int) {var}_n{x}
+        );
+    }}
+    {fail}
+}}
+"""
+    % _RUNTIME_BROADCAST_ERROR_MSG
+)
+
+# The lengths of a dimension must all be the same, except those of 1, which
+# are broadcasted to it.
+_BROADCAST_DIMS = """
+{{
+    npy_intp dims[{ndims}] = {{{dims}}};
+    int inputs[{ndims}] = {{{inputs}}};
+    int axes[{ndims}] = {{{axes}}};
+    npy_intp n = 1;
+    int k_n = 0;
+    for (int k = 0; k < {ndims}; k++) {{
+        if (dims[k] == 1) {{
+            continue;
+        }}
+        if (n != 1 && dims[k] != n) {{
+            PyErr_Format(PyExc_ValueError, "Input dimension mismatch: (input[%i].shape[%i] = %lld, input[%i].shape[%i] = %lld)",
+                inputs[k_n],
+                axes[k_n],
+                (long long int) n,
+                inputs[k],
+                axes[k],
+                (long long int) dims[k]
+            );
+            {fail}
+        }}
+        n = dims[k];
+        k_n = k;
+    }}
+    {set_dims}
+}}
+"""
+
+
 def make_declare(loop_orders, dtypes, sub):
     """
     Produce code to declare all necessary variables.
 
     """
-    decl = ""
+    code = _make_declare_cached(_freeze(loop_orders), _freeze(dtypes), _sub_key(sub))
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_declare_cached(loop_orders, dtypes, sub):
+    sub = dict(sub)
+    decl = []
     for i, (loop_order, dtype) in enumerate(zip(loop_orders, dtypes)):
-        var = sub[f"lv{int(i)}"]  # input name corresponding to ith loop variable
+        var = sub[f"lv{i}"]  # input name corresponding to ith loop variable
         # we declare an iteration variable
-        # and an integer for the number of dimensions
-        decl += f"""
-        {dtype}* {var}_iter;
-        """
+        # and an integer for the number of dimensions.
+        # The iteration pointers never alias each other (inplace outputs
+        # reuse the pointer of the input they overwrite), so we mark them
+        # as restricted to let the compiler vectorize the loops.
+        decl.append(_DECLARE_ITER.format_map(dict(dtype=dtype, var=var)))
         for j, value in enumerate(loop_order):
+            fields = dict(var=var, index=value, loop=j)
             if value != "x":
                 # If the dimension is not broadcasted, we declare
                 # the number of elements in that dimension,
                 # the stride in that dimension,
                 # and the jump from an iteration to the next
-                decl += f"""
-                npy_intp {var}_n{int(value)};
-                ssize_t {var}_stride{int(value)};
-                int {var}_jump{int(value)}_{int(j)};
-                """
-
+                decl.append(_DECLARE_DIM.format_map(fields))
             else:
                 # if the dimension is broadcasted, we only need
                 # the jump (arbitrary length and stride = 0)
-                decl += f"""
-                int {var}_jump{value}_{int(j)};
-                """
+                decl.append(_DECLARE_BROADCAST_DIM.format_map(fields))
 
-    return decl
+    return "".join(decl)
 
 
-def make_checks(loop_orders, dtypes, sub):
-    init = ""
-    for i, (loop_order, dtype) in enumerate(zip(loop_orders, dtypes)):
-        var = f"%(lv{int(i)})s"
+def make_checks(loop_orders, dtypes, sub, allow_runtime_broadcast=False):
+    """Generate C code to initialize and check the loop variables.
+
+    The lengths, strides and jumps of all the dimensions of the variables
+    are initialized, and the lengths of the dimensions they share are
+    checked to match.
+
+    If `allow_runtime_broadcast` is True, a dimension of length 1 at runtime
+    is broadcasted to the length of the other variables, like in NumPy: its
+    stride is masked to 0, and its length is set to the one of the others.
+    Otherwise, it raises an error about runtime broadcasting.
+
+    """
+    code = _make_checks_cached(
+        _freeze(loop_orders), _freeze(dtypes), _sub_key(sub), allow_runtime_broadcast
+    )
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_checks_cached(loop_orders, dtypes, sub, allow_runtime_broadcast):
+    sub = dict(sub)
+    loop_vars = [sub[f"lv{i}"] for i in range(len(loop_orders))]
+    fail = sub["fail"]
+    init = []
+    for var, loop_order, dtype in zip(loop_vars, loop_orders, dtypes):
         # List of dimensions of var that are not broadcasted
         nonx = [x for x in loop_order if x != "x"]
         if nonx:
@@ -47,12 +338,7 @@ def make_checks(loop_orders, dtypes, sub):
             # this is a check that the number of dimensions of the
             # tensor is as expected.
             min_nd = max(nonx) + 1
-            init += f"""
-            if (PyArray_NDIM({var}) < {min_nd}) {{
-                PyErr_SetString(PyExc_ValueError, "Not enough dimensions on input.");
-                %(fail)s
-            }}
-            """
+            init.append(_CHECK_NDIM.format_map(dict(var=var, min_nd=min_nd, fail=fail)))
 
         # In loop j, adjust represents the difference of values of the
         # data pointer between the beginning and the end of the
@@ -63,34 +349,28 @@ def make_checks(loop_orders, dtypes, sub):
 
         # We go from the inner loop to the outer loop
         for j, index in reversed(list(enumerate(loop_order))):
+            fields = dict(var=var, dtype=dtype, index=index, loop=j, mask="")
             if index != "x":
+                if allow_runtime_broadcast:
+                    fields["mask"] = _MASK_BROADCAST_STRIDE.format_map(fields)
                 # Initialize the variables associated to the jth loop
                 # jump = stride - adjust
-                jump = f"({var}_stride{index}) - ({adjust})"
-                init += f"""
-                {var}_n{index} = PyArray_DIMS({var})[{index}];
-                {var}_stride{index} = PyArray_STRIDES({var})[{index}] / sizeof({dtype});
-                {var}_jump{index}_{j} = {jump};
-                """
+                fields["jump"] = f"({var}_stride{index}) - ({adjust})"
+                init.append(_INIT_DIM.format_map(fields))
                 adjust = f"{var}_n{index}*{var}_stride{index}"
             else:
-                jump = f"-({adjust})"
-                init += f"""
-                {var}_jump{index}_{j} = {jump};
-                """
+                fields["jump"] = f"-({adjust})"
+                init.append(_INIT_BROADCAST_DIM.format_map(fields))
                 adjust = "0"
-    check = ""
-
-    # This loop builds multiple if conditions to verify that the
-    # dimensions of the inputs match, and the first one that is true
-    # raises an informative error message
+    check = []
 
-    runtime_broadcast_error_msg = (
-        "Runtime broadcasting not allowed. "
-        "One input had a distinct dimension length of 1, but was not marked as broadcastable: "
-        "(input[%%i].shape[%%i] = %%lld, input[%%i].shape[%%i] = %%lld). "
-        "If broadcasting was intended, use `specify_broadcastable` on the relevant input."
-    )
+    # This loop builds, for every loop dimension, a check that the
+    # dimensions of the inputs match. When more than two inputs share
+    # a dimension, all their lengths are gathered in a small array and
+    # compared at once through their min and max; only if those differ
+    # do we fall back to the pairwise conditions, the first one that
+    # is true raising an informative error message. With runtime
+    # broadcasting, the lengths of 1 are skipped instead.
 
     for matches in zip(*loop_orders):
         to_compare = [(j, x) for j, x in enumerate(matches) if x != "x"]
@@ -99,36 +379,63 @@ def make_checks(loop_orders, dtypes, sub):
         if len(to_compare) < 2:
             continue
 
+        if allow_runtime_broadcast:
+            set_dims = "\n".join(f"{loop_vars[j]}_n{x} = n;" for j, x in to_compare)
+            check.append(
+                _BROADCAST_DIMS.format_map(
+                    dict(
+                        ndims=len(to_compare),
+                        dims=", ".join(f"{loop_vars[j]}_n{x}" for j, x in to_compare),
+                        inputs=", ".join(str(j) for j, _ in to_compare),
+                        axes=", ".join(str(x) for _, x in to_compare),
+                        set_dims=set_dims,
+                        fail=fail,
+                    )
+                )
+            )
+            continue
+
         j0, x0 = to_compare[0]
-        for j, x in to_compare[1:]:
-            check += f"""
-            if (%(lv{j0})s_n{x0} != %(lv{j})s_n{x})
-            {{
-                if (%(lv{j0})s_n{x0} == 1 || %(lv{j})s_n{x} == 1)
-                {{
-                    PyErr_Format(PyExc_ValueError, "{runtime_broadcast_error_msg}",
-                   {j0},
-                   {x0},
-                   (long long int) %(lv{j0})s_n{x0},
-                   {j},
-                   {x},
-                   (long long int) %(lv{j})s_n{x}
-                    );
-                }} else {{
-                    PyErr_Format(PyExc_ValueError, "Input dimension mismatch: (input[%%i].shape[%%i] = %%lld, input[%%i].shape[%%i] = %%lld)",
-                       {j0},
-                       {x0},
-                       (long long int) %(lv{j0})s_n{x0},
-                       {j},
-                       {x},
-                       (long long int) %(lv{j})s_n{x}
-                    );
-                }}
-                %(fail)s
+        mismatch = [
+            _DIM_MISMATCH.format_map(
+                dict(
+                    var0=loop_vars[j0],
+                    x0=x0,
+                    j0=j0,
+                    var=loop_vars[j],
+                    x=x,
+                    j=j,
+                    fail=fail,
+                )
+            )
+            for j, x in to_compare[1:]
+        ]
+        mismatch = "".join(mismatch)
+
+        if len(to_compare) == 2:
+            # A single comparison is already as cheap as it gets
+            check.append(mismatch)
+            continue
+
+        ndims = len(to_compare)
+        dims = ", ".join(f"{loop_vars[j]}_n{x}" for j, x in to_compare)
+        check.append(
+            f"""
+        {{
+            npy_intp dims[{ndims}] = {{{dims}}};
+            npy_intp dims_min = dims[0], dims_max = dims[0];
+            for (int k = 1; k < {ndims}; k++) {{
+                dims_min = dims[k] < dims_min ? dims[k] : dims_min;
+                dims_max = dims[k] > dims_max ? dims[k] : dims_max;
+            }}
+            if (dims_min != dims_max) {{
+                {mismatch}
             }}
+        }}
         """
+        )
 
-    return init % sub + check % sub
+    return "".join(init) + "".join(check)
 
 
 def compute_output_dims_lengths(array_name: str, loop_orders, sub) -> str:
@@ -144,7 +451,7 @@ def compute_output_dims_lengths(array_name: str, loop_orders, sub) -> str:
         # Borrow the length of the first non-broadcastable input dimension
         for j, candidate in enumerate(candidates):
             if candidate != "x":
-                var = sub[f"lv{int(j)}"]
+                var = sub[f"lv{j}"]
                 dims_c_code += f"{array_name}[{i}] = {var}_n{candidate};\n"
                 break
         # If none is non-broadcastable, the output dimension has a length of 1
@@ -154,61 +461,140 @@ def compute_output_dims_lengths(array_name: str, loop_orders, sub) -> str:
     return dims_c_code
 
 
+def make_static_shape_checks(loop_orders, static_shape, sub):
+    """Generate C code checking that the loops have their static lengths.
+
+    The loops emitted with a `static_shape` use the known lengths as
+    literal bounds, so a mismatch at runtime must be reported before.
+
+    """
+    checks = []
+    for i, (candidates, length) in enumerate(zip(zip(*loop_orders), static_shape)):
+        if length is None:
+            continue
+        for j, candidate in enumerate(candidates):
+            if candidate != "x":
+                n = f"{sub[f'lv{j}']}_n{candidate}"
+                break
+        else:  # no-break
+            continue
+        checks.append(
+            f"""
+        if ({n} != {int(length)}) {{
+            PyErr_Format(PyExc_ValueError,
+                         "Dimension %d has length %lld, but its static length is %lld",
+                         {i}, (long long int) {n}, (long long int) {int(length)});
+            {sub['fail']}
+        }}
+        """
+        )
+    return "".join(checks)
+
+
+# Skeleton of the code emitted by `make_alloc`, filled with %-formatting
+_ALLOC = """
+{
+    npy_intp dims[%(nd)s];
+    //npy_intp* dims = (npy_intp*)malloc(%(nd)s * sizeof(npy_intp));
+    %(init_dims)s
+    int fortran = (%(fortran)s);
+    if (%(olv)s && !PyArray_ISWRITEABLE(%(olv)s)) {
+        // The ndarray we have can't be overwritten, nor resized.
+        Py_CLEAR(%(olv)s);
+    }
+    if (%(olv)s
+        && PyArray_NDIM(%(olv)s) == %(nd)s
+        && PyArray_TYPE(%(olv)s) == %(type)s
+        && (fortran ? PyArray_IS_F_CONTIGUOUS(%(olv)s)
+                    : PyArray_IS_C_CONTIGUOUS(%(olv)s))
+        && memcmp(PyArray_DIMS(%(olv)s), dims, %(nd)s * sizeof(npy_intp)) == 0) {
+        // The ndarray we have already has the right shape, dtype and
+        // layout: we reuse it as is.
+    }
+    else if (!%(olv)s || fortran) {
+        // PyArray_Resize can only give a c order ndarray
+        Py_XDECREF(%(olv)s);
+        %(olv)s = (PyArrayObject*)PyArray_EMPTY(%(nd)s, dims,
+                                                %(type)s,
+                                                fortran);
+    }
+    else {
+        PyArray_Dims new_dims;
+        new_dims.len = %(nd)s;
+        new_dims.ptr = dims;
+        PyObject* success = PyArray_Resize(%(olv)s, &new_dims, 0, NPY_CORDER);
+        if (!success) {
+            // If we can't resize the ndarray we have we can allocate a new one.
+            PyErr_Clear();
+            Py_XDECREF(%(olv)s);
+            %(olv)s = (PyArrayObject*)PyArray_EMPTY(%(nd)s, dims, %(type)s, 0);
+        } else {
+            Py_DECREF(success);
+        }
+    }
+    if (!%(olv)s) {
+        %(fail)s
+    }
+}
+"""
+
+
 def make_alloc(loop_orders, dtype, sub, fortran="0"):
     """Generate C code to allocate outputs.
 
     Parameters
     ----------
-    fortran : str
+    fortran : str or None
         A string included in the generated code. If it
         evaluate to non-zero, an ndarray in fortran order will be
-        created, otherwise it will be c order.
+        created, otherwise it will be c order. If None, the
+        ndarray is in fortran order when all the variables of
+        loop_orders that are not broadcasted are in fortran order.
 
     """
+    code = _make_alloc_cached(_freeze(loop_orders), dtype, _sub_key(sub), fortran)
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_alloc_cached(loop_orders, dtype, sub, fortran):
+    sub = dict(sub)
     type = dtype.upper()
     if type.startswith("PYTENSOR_COMPLEX"):
         type = type.replace("PYTENSOR_COMPLEX", "NPY_COMPLEX")
     nd = len(loop_orders[0])
     init_dims = compute_output_dims_lengths("dims", loop_orders, sub)
+    if fortran is None:
+        # If they are all scalars, it is c order to prevent problems
+        # with NumPy C and F contig not always set as both of them.
+        fortran = (
+            " && ".join(
+                f"PyArray_ISFORTRAN({sub[f'lv{i}']})"
+                for i, loop_order in enumerate(loop_orders)
+                if any(index != "x" for index in loop_order)
+            )
+            or "0"
+        )
 
     # TODO: it would be interesting to allocate the output in such a
     # way that its contiguous dimensions match one of the input's
     # contiguous dimensions, or the dimension with the smallest
-    # stride. Right now, it is allocated to be C_CONTIGUOUS.
-    return """
-    {
-        npy_intp dims[%(nd)s];
-        //npy_intp* dims = (npy_intp*)malloc(%(nd)s * sizeof(npy_intp));
-        %(init_dims)s
-        if (!%(olv)s) {
-            %(olv)s = (PyArrayObject*)PyArray_EMPTY(%(nd)s, dims,
-                                                    %(type)s,
-                                                    %(fortran)s);
-        }
-        else {
-            PyArray_Dims new_dims;
-            new_dims.len = %(nd)s;
-            new_dims.ptr = dims;
-            PyObject* success = PyArray_Resize(%(olv)s, &new_dims, 0, NPY_CORDER);
-            if (!success) {
-                // If we can't resize the ndarray we have we can allocate a new one.
-                PyErr_Clear();
-                Py_XDECREF(%(olv)s);
-                %(olv)s = (PyArrayObject*)PyArray_EMPTY(%(nd)s, dims, %(type)s, 0);
-            } else {
-                Py_DECREF(success);
-            }
-        }
-        if (!%(olv)s) {
-            %(fail)s
-        }
-    }
-    """ % dict(
-        locals(), **sub
-    )
-
-
-def make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=None):
+    # stride. Right now, it is allocated to be C_CONTIGUOUS, or
+    # F_CONTIGUOUS when the inputs are.
+    return _ALLOC % dict(locals(), **sub)
+
+
+def make_loop(
+    loop_orders,
+    dtypes,
+    loop_tasks,
+    sub,
+    openmp=None,
+    simd_task=None,
+    read_only=(),
+    static_shape=None,
+    contiguous_loop=True,
+):
     """
     Make a nested loop over several arrays and associate specific code
     to each level of nesting.
@@ -231,62 +617,417 @@ def make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=None):
     sub : dictionary
         Maps 'lv#' to a suitable variable name.
         The 'lvi' variable corresponds to the ith element of loop_orders.
+    simd_task : list of (str, int) pairs, optional
+        An equivalent of the inner-most task, as the intrinsic applying it
+        on SIMD registers of the given number of lanes, from the widest
+        registers to the narrowest. The intrinsic takes one register per
+        input and returns the register of the output, which must be the last
+        variable. See `make_simd_task`.
+    read_only : collection of int, optional
+        The indices of the variables that the tasks only read. In the
+        inner-most loop, their elements are copied into the 'lvi_i' variables
+        instead of being bound to them by reference, which lets the compiler
+        keep them in registers.
+    static_shape : tuple of int or None, optional
+        The lengths of the loops that are known at compile time. They are used
+        as literal bounds, which lets the compiler unroll the loops. It is
+        checked at runtime that the arrays have these lengths, which needs
+        the 'fail' code in `sub`.
+    contiguous_loop : bool, optional
+        Whether to add a flat loop over all the elements, used when the arrays
+        are C-contiguous, see `make_contiguous_loop`. The `simd_task` is only
+        used by that loop. Callers handling C-contiguous arrays themselves
+        can disable it.
 
     """
-
-    def loop_over(preloop, code, indices, i):
-        iterv = f"ITER_{int(i)}"
-        update = ""
+    code = _make_loop_cached(
+        _freeze(loop_orders),
+        _freeze(dtypes),
+        _normalize(_freeze(loop_tasks), sub),
+        _sub_key(sub),
+        openmp,
+        _freeze(simd_task),
+        _freeze(read_only),
+        _freeze(static_shape),
+        contiguous_loop,
+        # The OpenMP pragmas depend on it
+        config.openmp_elemwise_minsize,
+    )
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_loop_cached(
+    loop_orders,
+    dtypes,
+    loop_tasks,
+    sub,
+    openmp,
+    simd_task,
+    read_only,
+    static_shape,
+    contiguous_loop,
+    openmp_elemwise_minsize,
+):
+    sub = dict(sub)
+    nnested = len(loop_tasks) - 1
+    loop_vars = [sub[f"lv{j}"] for j in range(len(loop_orders))]
+    if static_shape is None:
+        static_shape = (None,) * nnested
+
+    def get_suitable_n(indices, i):
+        if static_shape[i] is not None:
+            return str(int(static_shape[i]))
         suitable_n = "1"
         for j, index in enumerate(indices):
-            var = sub[f"lv{int(j)}"]
-            dtype = dtypes[j]
-            update += f"{dtype} &{var}_i = * ( {var}_iter + {iterv} * {var}_jump{index}_{i} );\n"
-
             if index != "x":
-                suitable_n = f"{var}_n{index}"
-        if openmp:
-            openmp_elemwise_minsize = config.openmp_elemwise_minsize
-            forloop = f"""#pragma omp parallel for if( {suitable_n} >={openmp_elemwise_minsize})\n"""
+                suitable_n = f"{loop_vars[j]}_n{index}"
+        return suitable_n
+
+    def loop_over(preloop, task, indices, i, declare):
+        """Return the code opening the ith loop, and the code closing it.
+
+        The loops nested in the ith one go in between.
+
+        """
+        iterv = f"ITER_{i}"
+        init = []
+        update = []
+        increment = []
+        for j, index in enumerate(indices):
+            var = loop_vars[j]
+            dtype = dtypes[j]
+            if openmp and i == ncollapse - 1:
+                # The iterations of the parallel loops are independent, so
+                # each one gets its own pointers, computed from the indices
+                # of the collapsed loops.
+                offset = "".join(
+                    f" + ITER_{k} * {var}_stride{outer_index}"
+                    for k, outer_index in enumerate(loop_orders[j][:ncollapse])
+                    if outer_index != "x"
+                )
+                init.append(
+                    f"{dtype}* __restrict__ {var}_iter = ({dtype}*)(PyArray_DATA({var})){offset};"
+                )
+            if declare and i == nnested - 1 and j in read_only:
+                update.append(f"{dtype} {var}_i = *{var}_iter;")
+            elif declare:
+                update.append(f"{dtype} &{var}_i = *{var}_iter;")
+            # The pointers are moved to the next element at the end of each
+            # iteration. As the jump is the stride minus what the inner loops
+            # already moved the pointer by, this holds at every level.
+            if not (openmp and i < ncollapse):
+                increment.append(f"{var}_iter += {var}_jump{index}_{i};")
+        suitable_n = get_suitable_n(indices, i)
+        # Only the outer-most loop is parallelized: nested parallel regions
+        # would be serialized by most OpenMP runtimes anyway. The loops that
+        # are directly nested in it are collapsed with it, and the minimum
+        # size is compared to the total number of iterations.
+        if openmp and i == 0:
+            total = "*".join(
+                get_suitable_n(indices, k)
+                for k, indices in enumerate(zip(*loop_orders))
+            )
+            collapse = f" collapse({ncollapse})" if ncollapse > 1 else ""
+            forloop = f"""#pragma omp parallel for{collapse} if( {total} >={openmp_elemwise_minsize})\n"""
         else:
             forloop = ""
         forloop += f"""for (int {iterv} = 0; {iterv}<{suitable_n}; {iterv}++)"""
-        return f"""
-        {preloop}
-        {forloop} {{
-            {update}
-            {code}
-        }}
-        """
+        head = "\n".join([preloop, f"{forloop} {{", *init, *update])
+        tail = "\n".join([task, *increment, "}"])
+        return head, tail
 
     preloops = {}
-    for i, (loop_order, dtype) in enumerate(zip(loop_orders, dtypes)):
+    for var, loop_order, dtype in zip(loop_vars, loop_orders, dtypes):
         for j, index in enumerate(loop_order):
             if index != "x":
-                preloops.setdefault(j, "")
-                preloops[j] += (
-                    f"%(lv{i})s_iter = ({dtype}*)(PyArray_DATA(%(lv{i})s));\n"
-                ) % sub
                 break
         else:  # all broadcastable
-            preloops.setdefault(0, "")
-            preloops[0] += (
-                f"%(lv{i})s_iter = ({dtype}*)(PyArray_DATA(%(lv{i})s));\n"
-            ) % sub
+            j = 0
+        preloops.setdefault(j, []).append(
+            f"{var}_iter = ({dtype}*)(PyArray_DATA({var}));\n"
+        )
+    preloops = {j: "".join(preloop) for j, preloop in preloops.items()}
+
+    # The loop variables of the ith loop are only needed if some code is
+    # executed inside of it, besides the (i+1)th loop.
+    declare = [
+        i == nnested - 1 or bool(loop_tasks[i][1] or loop_tasks[i + 1][0])
+        for i in range(nnested)
+    ]
+    # Number of outer loops that are perfectly nested
+    ncollapse = 1
+    while (
+        ncollapse < nnested
+        and not declare[ncollapse - 1]
+        and not preloops.get(ncollapse)
+    ):
+        ncollapse += 1
+
+    # The loops are opened from the outer-most to the inner-most one, and
+    # closed in the reverse order.
+    heads = []
+    tails = []
+    for i, (pre_task, task), indices in zip(
+        range(nnested), loop_tasks, zip(*loop_orders)
+    ):
+        head, tail = loop_over(
+            preloops.get(i, "") + pre_task, task, indices, i, declare[i]
+        )
+        heads.append(head)
+        tails.append(tail)
+    s = "\n".join(heads + tails[::-1])
+
+    if contiguous_loop:
+        s = make_contiguous_loop(
+            loop_orders,
+            dtypes,
+            loop_tasks,
+            s,
+            sub,
+            openmp,
+            simd_task=simd_task,
+            read_only=read_only,
+            static_shape=static_shape,
+            openmp_elemwise_minsize=openmp_elemwise_minsize,
+        )
+
+    s = make_static_shape_checks(loop_orders, static_shape, sub) + s
+    s += loop_tasks[-1]
+    return f"{{{s}}}"
+
+
+def make_loop_fused(loop_orders, dtypes, list_of_loop_tasks, sub, openmp=None):
+    """Make a single nested loop executing the tasks of several `make_loop`.
 
-    s = ""
+    This is meant for chains of operations sharing the same loop orders: the
+    arrays are traversed once, and the results of an operation can be
+    passed to the next through local C variables instead of intermediate
+    arrays.
 
-    for i, (pre_task, task), indices in reversed(
-        list(zip(range(len(loop_tasks) - 1), loop_tasks, list(zip(*loop_orders))))
+    Parameters
+    ----------
+    loop_orders : list of N tuples of length M
+        The loop orders of all the variables used by the tasks, as in
+        `make_loop`.
+    dtypes : list of N str
+        The dtypes of all the variables used by the tasks.
+    list_of_loop_tasks : list of lists of M+1 pieces of code
+        The `loop_tasks` of each operation, as in `make_loop`. At each level
+        of nesting, the tasks are executed in the order of this list. They
+        share the same scope, so that a task can declare a variable used by
+        the following ones.
+    sub : dictionary
+        Maps 'lv#' to a suitable variable name.
+        The 'lvi' variable corresponds to the ith element of loop_orders.
+
+    """
+    if len({len(tasks) for tasks in list_of_loop_tasks}) != 1:
+        raise ValueError("All the loop_tasks must have the same number of levels.")
+
+    loop_tasks = [
+        (
+            "".join(pre_task for pre_task, _ in level_tasks),
+            "".join(task for _, task in level_tasks),
+        )
+        for level_tasks in zip(*(tasks[:-1] for tasks in list_of_loop_tasks))
+    ]
+    loop_tasks.append("".join(tasks[-1] for tasks in list_of_loop_tasks))
+    return make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=openmp)
+
+
+# The number of elements of the tiles of `make_contiguous_loop`: as many
+# float32 as there are in the widest SIMD registers.
+TILE = 16
+# The minimum number of arrays traversed by tiles, e.g. three inputs and an
+# output, or two outputs. The tiles add a third copy of the scalar task to
+# the loops, which doesn't pay off for unary and binary operations.
+TILE_MIN_ARRAYS = 4
+
+
+def make_contiguous_loop(
+    loop_orders,
+    dtypes,
+    loop_tasks,
+    loop,
+    sub,
+    openmp=None,
+    simd_task=None,
+    read_only=(),
+    static_shape=None,
+    openmp_elemwise_minsize=None,
+):
+    """Generate a flat loop for `make_loop`, used when all arrays are C-contiguous.
+
+    When only the inner-most loop executes code and every variable either
+    loops over all of its dimensions in order, or is broadcasted over all of
+    them, the nested loops can be collapsed into a single one over all the
+    elements of the arrays, provided they are C-contiguous.
+
+    `loop` is the code of the nested loops. It is returned unchanged if the
+    loops can't be collapsed, otherwise it is used as a fallback when the
+    arrays turn out not to be C-contiguous at runtime.
+
+    If a `simd_task` is given (see `make_loop`) and all the variables have
+    the same dtype, most of the elements are processed with SIMD
+    instructions, when the compiler targets them, and the remaining ones
+    with the scalar task. Otherwise, when at least `TILE_MIN_ARRAYS` arrays
+    of the same dtype are traversed, they are processed by tiles of `TILE`
+    elements. `read_only` and `static_shape` are as in `make_loop`. The loops
+    are parallelized with OpenMP over at least `openmp_elemwise_minsize`
+    elements, which defaults to the value of the config.
+
+    """
+    if openmp_elemwise_minsize is None:
+        openmp_elemwise_minsize = config.openmp_elemwise_minsize
+    nnested = len(loop_tasks) - 1
+    if nnested == 0:
+        return loop
+    # Code executed outside the inner-most loop can't be collapsed
+    if any(task != ("", "") for task in loop_tasks[:-2]) or loop_tasks[-2][0]:
+        return loop
+
+    full = []
+    for i, loop_order in enumerate(loop_orders):
+        if list(loop_order) == list(range(nnested)):
+            full.append(i)
+        elif any(index != "x" for index in loop_order):
+            return loop
+    if not full:
+        return loop
+
+    cond = " && ".join(f"PyArray_IS_C_CONTIGUOUS({sub[f'lv{i}']})" for i in full)
+    # The arrays may still differ in size, if some of their dimensions are
+    # broadcasted at runtime (see `make_checks`).
+    cond += "".join(
+        f" && PyArray_SIZE({sub[f'lv{i}']}) == PyArray_SIZE({sub[f'lv{full[0]}']})"
+        for i in full[1:]
+    )
+    declare_iter = ""
+    update = ""
+    for i, dtype in enumerate(dtypes):
+        var = sub[f"lv{i}"]
+        declare_iter += f"{var}_iter = ({dtype}*)(PyArray_DATA({var}));\n"
+        ref = "" if i in read_only else "&"
+        if i in full:
+            update += f"{dtype} {ref}{var}_i = {var}_iter[ITER];\n"
+        else:
+            update += f"{dtype} {ref}{var}_i = *{var}_iter;\n"
+
+    if static_shape is not None and None not in static_shape:
+        total = str(prod(int(length) for length in static_shape))
+    else:
+        total = f"PyArray_SIZE({sub[f'lv{full[0]}']})"
+
+    def omp_pragma(size):
+        if not openmp:
+            return ""
+        return f"""#pragma omp parallel for if( {size} >={openmp_elemwise_minsize})\n"""
+
+    simd_loop = ""
+    start = "0"
+    if simd_task and len(set(dtypes)) == 1 and len(dtypes) - 1 in full:
+        registers = {r["lanes"]: r for r in SIMD_REGISTERS.get(dtypes[0], [])}
+        directive = "#if"
+        for vec_op, lanes in simd_task:
+            if lanes not in registers:
+                continue
+            register = registers[lanes]
+            vtype = register["vtype"]
+            load_inputs = ""
+            for i in range(len(dtypes) - 1):
+                var = sub[f"lv{i}"]
+                if i in full:
+                    value = register["load"].format(f"{var}_iter + ITER")
+                else:
+                    value = register["set1"].format(f"*{var}_iter")
+                load_inputs += f"{vtype} {var}_v = {value};\n"
+            inputs = ", ".join(f"{sub[f'lv{i}']}_v" for i in range(len(dtypes) - 1))
+            out = sub[f"lv{len(dtypes) - 1}"]
+            store = register["store"].format(
+                f"{out}_iter + ITER", f"{vec_op}({inputs})"
+            )
+            simd_loop += f"""
+{directive} defined({register['macro']})
+        SIMD_TOTAL = TOTAL - TOTAL % {lanes};
+        {omp_pragma("SIMD_TOTAL")}for (npy_intp ITER = 0; ITER<SIMD_TOTAL; ITER+={lanes}) {{
+            {load_inputs}
+            {store};
+        }}
+"""
+            directive = "#elif"
+        if simd_loop:
+            simd_loop = f"""
+        npy_intp SIMD_TOTAL = 0;
+{simd_loop}
+#endif
+"""
+            start = "SIMD_TOTAL"
+
+    # Without SIMD instructions, when many arrays of the same dtype are
+    # traversed, the elements are processed by tiles of TILE elements. The
+    # loop over a tile has a constant number of iterations and no remainder,
+    # which the compiler vectorizes and unrolls more readily than the flat
+    # loop.
+    tile_loop = ""
+    if (
+        not simd_loop
+        and len(full) >= TILE_MIN_ARRAYS
+        and len({dtypes[i] for i in full}) == 1
     ):
-        s = loop_over(preloops.get(i, "") + pre_task, s + task, indices, i)
+        tile_update = ""
+        for i, dtype in enumerate(dtypes):
+            var = sub[f"lv{i}"]
+            ref = "" if i in read_only else "&"
+            if i in full:
+                tile_update += (
+                    f"{dtype} {ref}{var}_i = {var}_iter[TILE_START + TILE_K];\n"
+                )
+            else:
+                tile_update += f"{dtype} {ref}{var}_i = *{var}_iter;\n"
+        tile_loop = f"""
+        npy_intp TILE_TOTAL = TOTAL - TOTAL % {TILE};
+        {omp_pragma("TILE_TOTAL")}for (npy_intp TILE_START = 0; TILE_START<TILE_TOTAL; TILE_START+={TILE}) {{
+            for (int TILE_K = 0; TILE_K < {TILE}; TILE_K++) {{
+                {tile_update}
+                {loop_tasks[-2][1]}
+            }}
+        }}
+        """
+        start = "TILE_TOTAL"
 
-    s += loop_tasks[-1]
-    return f"{{{s}}}"
+    if start == "0":
+        forloop = omp_pragma("TOTAL")
+    else:
+        forloop = omp_pragma(f"TOTAL - {start}")
+    forloop += f"for (npy_intp ITER = {start}; ITER<TOTAL; ITER++)"
+
+    return f"""
+    if ({cond}) {{
+        {declare_iter}
+        npy_intp TOTAL = {total};
+        {simd_loop}
+        {tile_loop}
+        {forloop} {{
+            {update}
+            {loop_tasks[-2][1]}
+        }}
+    }}
+    else {{
+        {loop}
+    }}
+    """
 
 
 def make_reordered_loop(
-    init_loop_orders, olv_index, dtypes, inner_task, sub, openmp=None
+    init_loop_orders,
+    olv_index,
+    dtypes,
+    inner_task,
+    sub,
+    openmp=None,
+    read_only=(),
+    static_shape=None,
 ):
     """A bit like make_loop, but when only the inner-most loop executes code.
 
@@ -297,64 +1038,128 @@ def make_reordered_loop(
 
     The output tensor's index among the loop variables is indicated by olv_index.
 
-    """
+    The variables whose indices are in read_only are copied into their 'lvi_i'
+    variable instead of being bound to it by reference, see `make_loop`. The
+    lengths known in static_shape are the literal bounds of the loops used
+    when the output tensor is C-contiguous.
 
+    """
+    code = _make_reordered_loop_cached(
+        _freeze(init_loop_orders),
+        olv_index,
+        _freeze(dtypes),
+        _normalize(inner_task, sub),
+        _sub_key(sub),
+        openmp,
+        _freeze(read_only),
+        _freeze(static_shape),
+        # The OpenMP pragmas depend on it
+        config.openmp_elemwise_minsize,
+    )
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_reordered_loop_cached(
+    init_loop_orders,
+    olv_index,
+    dtypes,
+    inner_task,
+    sub,
+    openmp,
+    read_only,
+    static_shape,
+    openmp_elemwise_minsize,
+):
+    sub = dict(sub)
     # Number of variables
     nvars = len(init_loop_orders)
     # Number of loops (dimensionality of the variables)
     nnested = len(init_loop_orders[0])
 
+    loop_vars = [sub[f"lv{i}"] for i in range(nvars)]
     # This is the var from which we'll get the loop order
-    ovar = sub[f"lv{int(olv_index)}"]
+    ovar = loop_vars[olv_index]
+
+    # When ovar is C-contiguous, the loops iterate over its dimensions in
+    # order, so the lengths known in static_shape can be used as literal
+    # bounds, which lets the compiler unroll the loops. These loops are
+    # only emitted if some of the lengths are worth it.
+    static_loops = static_shape is not None and any(
+        length is not None and length > 1 for length in static_shape
+    )
 
     # The loops are ordered by (decreasing) absolute values of ovar's strides.
+    # The resulting permutation of the initial loop order is stored in
+    # {ovar}_perm: the ith loop iterates over the {ovar}_perm[i]th dimension.
+    # When ovar is C-contiguous, which is always the case when it was just
+    # allocated, the strides already decrease with the dimension index and
+    # the permutation is the identity, so we don't need to sort anything.
+    # That case is already handled by the static loops, when there are some.
+    if static_loops:
+        order_loops = [f"int {ovar}_perm[{nnested}];\n{{"]
+    else:
+        static_perm = "".join(f"{ovar}_perm[{i}] = {i};\n" for i in range(nnested))
+        order_loops = [
+            f"""
+    int {ovar}_perm[{nnested}];
+    if (PyArray_IS_C_CONTIGUOUS({ovar})) {{
+        {static_perm}
+    }}
+    else {{
+    """
+        ]
+
     # The first element of each pair is the absolute value of the stride
     # The second element correspond to the index in the initial loop order
-    order_loops = f"""
-    std::vector< std::pair<int, int> > {ovar}_loops({int(nnested)});
-    std::vector< std::pair<int, int> >::iterator {ovar}_loops_it = {ovar}_loops.begin();
+    order_loops.append(
+        f"""
+    std::vector< std::pair<npy_intp, int> > {ovar}_loops({nnested});
+    std::vector< std::pair<npy_intp, int> >::iterator {ovar}_loops_it = {ovar}_loops.begin();
     """
+    )
 
     # Fill the loop vector with the appropriate <stride, index> pairs
     for i, index in enumerate(init_loop_orders[olv_index]):
         if index != "x":
-            order_loops += f"""
-            {ovar}_loops_it->first = abs(PyArray_STRIDES({ovar})[{int(index)}]);
-            """
+            # The strides were already read and divided by the item size in
+            # `make_checks`, which doesn't change their order.
+            stride = f"{ovar}_stride{index}"
+            order_loops.append(
+                f"{ovar}_loops_it->first = {stride} < 0 ? -{stride} : {stride};"
+            )
         else:
             # Stride is 0 when dimension is broadcastable
-            order_loops += f"""
-            {ovar}_loops_it->first = 0;
-            """
+            order_loops.append(f"{ovar}_loops_it->first = 0;")
 
-        order_loops += f"""
-        {ovar}_loops_it->second = {int(i)};
-        ++{ovar}_loops_it;
-        """
+        order_loops.append(f"{ovar}_loops_it->second = {i};")
+        order_loops.append(f"++{ovar}_loops_it;")
 
     # We sort in decreasing order so that the outermost loop (loop 0)
     # has the largest stride, and the innermost loop (nnested - 1) has
     # the smallest stride.
-    order_loops += f"""
+    order_loops.append(
+        f"""
     // rbegin and rend are reversed iterators, so this sorts in decreasing order
     std::sort({ovar}_loops.rbegin(), {ovar}_loops.rend());
+    for (int i = 0; i < {nnested}; i++) {{
+        {ovar}_perm[i] = {ovar}_loops[i].second;
+    }}
+    }}
     """
+    )
 
-    # Get the (sorted) total number of iterations of each loop
-    declare_totals = f"int init_totals[{nnested}];\n"
-    declare_totals += compute_output_dims_lengths("init_totals", init_loop_orders, sub)
+    # Get the total number of iterations of each loop, in the initial order
+    init_totals = [
+        f"npy_intp init_totals[{nnested}];",
+        compute_output_dims_lengths("init_totals", init_loop_orders, sub),
+    ]
 
     # Sort totals to match the new order that was computed by sorting
     # the loop vector. One integer variable per loop is declared.
-    declare_totals += f"""
-    {ovar}_loops_it = {ovar}_loops.begin();
-    """
-
-    for i in range(nnested):
-        declare_totals += f"""
-        int TOTAL_{int(i)} = init_totals[{ovar}_loops_it->second];
-        ++{ovar}_loops_it;
-        """
+    declare_totals = [
+        f"npy_intp TOTAL_{i} = init_totals[{ovar}_perm[{i}]];" for i in range(nnested)
+    ]
 
     # Get sorted strides
     # Get strides in the initial order
@@ -365,7 +1170,7 @@ def make_reordered_loop(
         specified loop_order.
 
         """
-        var = sub[f"lv{int(i)}"]
+        var = loop_vars[i]
         r = []
         for index in loop_order:
             # Note: the stride variable is not declared for broadcasted variables
@@ -375,74 +1180,128 @@ def make_reordered_loop(
                 r.append("0")
         return r
 
-    # We declare the initial strides as a 2D array, nvars x nnested
-    strides = ", \n".join(
-        ", ".join(get_loop_strides(lo, i))
-        for i, lo in enumerate(init_loop_orders)
-        if len(lo) > 0
-    )
+    # Declare (sorted) stride and for each variable. The stride of the jth
+    # loop is picked by switching on the dimension it iterates over, which
+    # avoids going through a 2D array of all the strides in memory.
+    loop_strides = [get_loop_strides(lo, i) for i, lo in enumerate(init_loop_orders)]
+    declare_strides = [
+        f"npy_intp {var}_stride_l{j};" for var in loop_vars for j in range(nnested)
+    ]
+    for j in range(nnested):
+        cases = "\n".join(
+            "\n".join(
+                [
+                    f"case {k}:",
+                    *(
+                        f"{var}_stride_l{j} = {strides[k]};"
+                        for var, strides in zip(loop_vars, loop_strides)
+                    ),
+                    "break;",
+                ]
+            )
+            for k in range(nnested)
+        )
+        declare_strides.append(f"switch ({ovar}_perm[{j}]) {{\n{cases}\n}}")
+
+    # Collapse adjacent loops that can be executed as a single one, i.e.
+    # when, for every variable, moving one step in the outer loop is the
+    # same as moving TOTAL steps in the inner loop. The outer loop is folded
+    # into the inner one, and is left with a single iteration. Going from
+    # the outer-most loop to the inner-most one, the folded loops can be
+    # folded again, so that the inner-most loop gets as many iterations as
+    # possible. When OpenMP is used, the loops are left untouched to keep the
+    # outer-most one, which is the one parallelized.
+    fuse_loops = []
+    if not openmp:
+        for outer in range(nnested - 1):
+            inner = outer + 1
+            move_strides = "\n".join(
+                f"{var}_stride_l{inner} = {var}_stride_l{outer};" for var in loop_vars
+            )
+            cond = " && ".join(
+                f"{var}_stride_l{outer} == {var}_stride_l{inner} * TOTAL_{inner}"
+                for var in loop_vars
+            )
+            fuse_loops.append(
+                f"""
+            if (TOTAL_{inner} == 1) {{
+                // The inner loop doesn't move: it takes the place of the outer one
+                {move_strides}
+                TOTAL_{inner} = TOTAL_{outer};
+                TOTAL_{outer} = 1;
+            }}
+            else if ({cond}) {{
+                TOTAL_{inner} *= TOTAL_{outer};
+                TOTAL_{outer} = 1;
+            }}
+            """
+            )
 
-    declare_strides = f"""
-    int init_strides[{int(nvars)}][{int(nnested)}] = {{
-        {strides}
-    }};"""
+    declare_iter = [
+        f"{var}_iter = ({dtype}*)(PyArray_DATA({var}));"
+        for var, dtype in zip(loop_vars, dtypes)
+    ]
 
-    # Declare (sorted) stride and for each variable
-    # we iterate from innermost loop to outermost loop
-    declare_strides += f"""
-    std::vector< std::pair<int, int> >::reverse_iterator {ovar}_loops_rit;
-    """
+    def make_loops(totals, strides):
+        """Return the code of the loops executing the inner task.
 
-    for i in range(nvars):
-        var = sub[f"lv{int(i)}"]
-        declare_strides += f"""
-        {ovar}_loops_rit = {ovar}_loops.rbegin();"""
-        for j in reversed(range(nnested)):
-            declare_strides += f"""
-            int {var}_stride_l{int(j)} = init_strides[{int(i)}][{ovar}_loops_rit->second];
-            ++{ovar}_loops_rit;
-            """
-
-    declare_iter = ""
-    for i, dtype in enumerate(dtypes):
-        var = sub[f"lv{int(i)}"]
-        declare_iter += f"{var}_iter = ({dtype}*)(PyArray_DATA({var}));\n"
+        The ith loop has totals[i] iterations, and strides[j][i] is the
+        stride of the jth variable in that loop.
 
-    pointer_update = ""
-    for j, dtype in enumerate(dtypes):
-        var = sub[f"lv{int(j)}"]
-        pointer_update += f"{dtype} &{var}_i = * ( {var}_iter"
-        for i in reversed(range(nnested)):
-            iterv = f"ITER_{int(i)}"
-            pointer_update += f"+{var}_stride_l{int(i)}*{iterv}"
-        pointer_update += ");\n"
-
-    loop = inner_task
-    for i in reversed(range(nnested)):
-        iterv = f"ITER_{int(i)}"
-        total = f"TOTAL_{int(i)}"
-        update = ""
-        forloop = ""
-        # The pointers are defined only in the most inner loop
-        if i == nnested - 1:
-            update = pointer_update
-        if i == 0:
-            if openmp:
-                openmp_elemwise_minsize = config.openmp_elemwise_minsize
-                forloop += f"""#pragma omp parallel for if( {total} >={openmp_elemwise_minsize})\n"""
-        forloop += f"for(int {iterv} = 0; {iterv}<{total}; {iterv}++)"
-
-        loop = f"""
-        {forloop}
-        {{ // begin loop {int(i)}
-            {update}
-            {loop}
-        }} // end loop {int(i)}
         """
-
-    return "\n".join(
-        ["{", order_loops, declare_totals, declare_strides, declare_iter, loop, "}\n"]
-    )
+        pointer_update = []
+        for j, (var, dtype) in enumerate(zip(loop_vars, dtypes)):
+            ref = "" if j in read_only else "&"
+            offset = "".join(
+                f"+{strides[j][i]}*ITER_{i}"
+                for i in reversed(range(nnested))
+                if strides[j][i] != "0"
+            )
+            pointer_update.append(f"{dtype} {ref}{var}_i = * ( {var}_iter{offset});")
+
+        # The loops are opened from the outer-most to the inner-most one, and
+        # closed in the reverse order.
+        heads = []
+        tails = []
+        for i, total in enumerate(totals):
+            iterv = f"ITER_{i}"
+            if i == 0 and openmp:
+                heads.append(
+                    f"#pragma omp parallel for if( {total} >={openmp_elemwise_minsize})"
+                )
+            heads.append(f"for(npy_intp {iterv} = 0; {iterv}<{total}; {iterv}++)")
+            heads.append(f"{{ // begin loop {i}")
+            tails.append(f"}} // end loop {i}")
+        # The pointers are defined only in the most inner loop
+        return [*heads, *pointer_update, inner_task, *reversed(tails)]
+
+    loop = [
+        *order_loops,
+        *declare_totals,
+        *declare_strides,
+        *fuse_loops,
+        *make_loops(
+            [f"TOTAL_{i}" for i in range(nnested)],
+            [[f"{var}_stride_l{i}" for i in range(nnested)] for var in loop_vars],
+        ),
+    ]
+
+    # The static loops are not folded
+    if static_loops:
+        static_totals = [
+            f"init_totals[{i}]" if length is None else str(length)
+            for i, length in enumerate(static_shape)
+        ]
+        loop = [
+            make_static_shape_checks(init_loop_orders, static_shape, sub),
+            f"if (PyArray_IS_C_CONTIGUOUS({ovar})) {{",
+            *make_loops(static_totals, loop_strides),
+            "} else {",
+            *loop,
+            "}",
+        ]
+
+    return "\n".join(["{", *init_totals, *declare_iter, *loop, "}\n"])
 
 
 # print make_declare(((0, 1, 2, 3), ('x', 1, 0, 3), ('x', 'x', 'x', 0)),
@@ -507,13 +1366,25 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
         The 'lvi' variable corresponds to the ith element of loop_orders.
 
     """
+    code = _make_loop_careduce_cached(
+        _freeze(loop_orders),
+        _freeze(dtypes),
+        _normalize(_freeze(loop_tasks), sub),
+        _sub_key(sub),
+    )
+    return _substitute(code, sub)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make_loop_careduce_cached(loop_orders, dtypes, loop_tasks, sub):
+    sub = dict(sub)
+    loop_vars = [sub[f"lv{i}"] for i in range(len(loop_orders))]
 
     def loop_over(preloop, code, indices, i):
-        iterv = f"ITER_{int(i)}"
+        iterv = f"ITER_{i}"
         update = ""
         suitable_n = "1"
-        for j, index in enumerate(indices):
-            var = sub[f"lv{int(j)}"]
+        for var, index in zip(loop_vars, indices):
             update += f"{var}_iter += {var}_jump{index}_{i};\n"
             if index != "x":
                 suitable_n = f"{var}_n{index}"
@@ -526,19 +1397,16 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
         """
 
     preloops = {}
-    for i, (loop_order, dtype) in enumerate(zip(loop_orders, dtypes)):
+    for var, loop_order, dtype in zip(loop_vars, loop_orders, dtypes):
         for j, index in enumerate(loop_order):
             if index != "x":
-                preloops.setdefault(j, "")
-                preloops[j] += (
-                    f"%(lv{i})s_iter = ({dtype}*)(PyArray_DATA(%(lv{i})s));\n"
-                ) % sub
                 break
         else:  # all broadcastable
-            preloops.setdefault(0, "")
-            preloops[0] += (
-                f"%(lv{i})s_iter = ({dtype}*)(PyArray_DATA(%(lv{i})s));\n"
-            ) % sub
+            j = 0
+        preloops.setdefault(j, []).append(
+            f"{var}_iter = ({dtype}*)(PyArray_DATA({var}));\n"
+        )
+    preloops = {j: "".join(preloop) for j, preloop in preloops.items()}
 
     if len(loop_tasks) == 1:
         s = preloops.get(0, "")
@@ -19,10 +19,11 @@ from pytensor.link.c.basic import CLinker, OpWiseCLinker
 from pytensor.tensor import as_tensor_variable
 from pytensor.tensor.basic import second
 from pytensor.tensor.elemwise import CAReduce, DimShuffle, Elemwise
-from pytensor.tensor.math import Any, Sum
+from pytensor.tensor.elemwise_cgen import SIMD_REGISTERS, make_simd_task
+from pytensor.tensor.math import Any, Sum, add, int_div, mul, sub, true_div
 from pytensor.tensor.math import all as pt_all
 from pytensor.tensor.math import any as pt_any
-from pytensor.tensor.math import exp
+from pytensor.tensor.math import exp, maximum
 from pytensor.tensor.math import sum as pt_sum
 from pytensor.tensor.type import (
     TensorType,
@@ -33,6 +34,7 @@ from pytensor.tensor.type import (
     matrix,
     scalar,
     tensor,
+    tensor3,
     vector,
     vectors,
 )
@@ -790,6 +792,47 @@ class TestElemwise(unittest_tools.InferShapeTester):
     def test_runtime_broadcast_c(self):
         self.check_runtime_broadcast(Mode(linker="c"))
 
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    def test_dimension_mismatch_c(self):
+        # The lengths of a dimension shared by three inputs are checked at
+        # once, and compared pairwise only to report the mismatch
+        a, b, c = aes.float64("a"), aes.float64("b"), aes.float64("c")
+        op = Elemwise(aes.Composite([a, b, c], [a + b * c]))
+        x, y, z = (vector(name, dtype="float64") for name in "xyz")
+        f = pytensor.function(
+            [x, y, z], op(x, y, z), mode=Mode(linker="c", optimizer=None)
+        )
+
+        val = np.arange(2.0)
+        utt.assert_allclose(f(val, val, val), val + val * val)
+        for shapes, msg in [
+            (
+                [(2,), (3,), (2,)],
+                r"Input dimension mismatch: \(input\[0\]\.shape\[0\] = 2, "
+                r"input\[1\]\.shape\[0\] = 3\)",
+            ),
+            (
+                [(2,), (2,), (3,)],
+                r"Input dimension mismatch: \(input\[0\]\.shape\[0\] = 2, "
+                r"input\[2\]\.shape\[0\] = 3\)",
+            ),
+            (
+                [(2,), (2,), (1,)],
+                r"Runtime broadcasting not allowed\..*\(input\[0\]\.shape\[0\] = 2, "
+                r"input\[2\]\.shape\[0\] = 1\)",
+            ),
+            (
+                [(1,), (2,), (2,)],
+                r"Runtime broadcasting not allowed\..*\(input\[0\]\.shape\[0\] = 1, "
+                r"input\[1\]\.shape\[0\] = 2\)",
+            ),
+        ]:
+            with pytest.raises(ValueError, match=msg):
+                f(*(np.ones(shape) for shape in shapes))
+
     def test_str(self):
         op = Elemwise(aes.add, inplace_pattern={0: 0}, name=None)
         assert str(op) == "Add"
@@ -894,6 +937,219 @@ class TestElemwise(unittest_tools.InferShapeTester):
         ):
             x + y
 
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    @pytest.mark.parametrize(
+        "x_shape, y_shape",
+        [((7,), (7,)), ((3, 4), (1, 4)), ((None, 3), (4, 3)), ((2, 3, 4), (4,))],
+    )
+    def test_static_shape_c(self, x_shape, y_shape):
+        # The C loops are specialized to the static shape of the output
+        x = tensor(dtype="float64", shape=x_shape)
+        y = tensor(dtype="float64", shape=y_shape)
+        f = pytensor.function([x, y], exp(x) * y, mode=Mode(linker="c"))
+
+        rng = np.random.default_rng(utt.fetch_seed())
+        x_val = rng.random(tuple(4 if s is None else s for s in x_shape))
+        y_val = rng.random(y_shape)
+        utt.assert_allclose(f(x_val, y_val), np.exp(x_val) * y_val)
+        # Non-contiguous inputs
+        x_val = np.asfortranarray(x_val)
+        utt.assert_allclose(f(x_val, y_val), np.exp(x_val) * y_val)
+
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    @pytest.mark.parametrize(
+        "x_view",
+        [
+            # The loops are folded into a single one
+            lambda x: x,
+            lambda x: x[::-1, ::-1, ::-1],
+            lambda x: x.transpose(2, 0, 1),
+            # Only some of the loops are folded
+            lambda x: x[::-1],
+            lambda x: x[:, ::-1],
+            lambda x: x[:, ::2],
+            lambda x: x.transpose(1, 0, 2),
+        ],
+    )
+    def test_reordered_loop_c(self, x_view):
+        x = tensor3("x")
+        y = tensor3("y")
+        f = pytensor.function([x, y], x * y, mode=Mode(linker="c"))
+
+        rng = np.random.default_rng(utt.fetch_seed())
+        x_val = x_view(rng.random((4, 6, 5)).astype(x.dtype))
+        y_val = rng.random(x_val.shape).astype(y.dtype)
+        utt.assert_allclose(f(x_val, y_val), x_val * y_val)
+        utt.assert_allclose(f(y_val, x_val), x_val * y_val)
+
+    @staticmethod
+    def check_simd_c(op, np_op, dtype, random):
+        """Check the vectors processed with SIMD instructions against NumPy.
+
+        The elements that don't fill a SIMD register are processed with scalar
+        code. `random(rng, n)` draws `n` values of the inputs.
+
+        """
+        x = vector("x", dtype=dtype)
+        y = vector("y", dtype=dtype)
+        s = tensor(dtype=dtype, shape=(1,), name="s")
+        outs = [op(x, y), op(s, y), op(x, s)]
+        f = pytensor.function([x, y, s], outs, mode=Mode(linker="c", optimizer=None))
+
+        rng = np.random.default_rng(utt.fetch_seed())
+        lanes = [register["lanes"] for register in SIMD_REGISTERS[f"npy_{dtype}"]]
+        lengths = sorted({0, 1, 1003}.union(*({n - 1, n + 1} for n in lanes)))
+        for n in lengths:
+            x_val = random(rng, 2 * n)
+            y_val = random(rng, 2 * n)
+            s_val = random(rng, 1)
+            # Contiguous, reversed and strided inputs
+            for x_v, y_v in [
+                (x_val[:n], y_val[:n]),
+                (x_val[n:][::-1], y_val[:n]),
+                (x_val[::2], y_val[1::2]),
+            ]:
+                expected = [np_op(x_v, y_v), np_op(s_val, y_v), np_op(x_v, s_val)]
+                for res, exp_res in zip(f(x_v, y_v, s_val), expected):
+                    assert res.dtype == exp_res.dtype
+                    if res.dtype.kind in "iu":
+                        np.testing.assert_array_equal(res, exp_res)
+                    else:
+                        utt.assert_allclose(res, exp_res)
+        return f
+
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    @pytest.mark.parametrize("dtype", ["float32", "float64"])
+    @pytest.mark.parametrize(
+        "op, np_op",
+        [(add, np.add), (sub, np.subtract), (mul, np.multiply), (true_div, np.divide)],
+    )
+    def test_simd_c(self, op, np_op, dtype):
+        def random(rng, n):
+            return (rng.random(n) + 1).astype(dtype)
+
+        f = self.check_simd_c(op, np_op, dtype, random)
+        for node in f.maker.fgraph.apply_nodes:
+            assert node.op._c_simd_task(node)
+
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    @pytest.mark.parametrize(
+        "dtype",
+        ["int8", "uint8", "int16", "uint16", "int32", "uint32", "int64", "uint64"],
+    )
+    @pytest.mark.parametrize(
+        "op, np_op", [(add, np.add), (sub, np.subtract), (mul, np.multiply)]
+    )
+    def test_simd_c_integers(self, op, np_op, dtype):
+        # The values span the whole range of the dtype, so that the results
+        # wrap around like in NumPy
+        def random(rng, n):
+            info = np.iinfo(dtype)
+            return rng.integers(info.min, info.max, n, dtype=dtype, endpoint=True)
+
+        f = self.check_simd_c(op, np_op, dtype, random)
+        # There are no SIMD multiplications of 8 or 64 bits integers
+        has_simd = op is not mul or np.dtype(dtype).itemsize in (2, 4)
+        for node in f.maker.fgraph.apply_nodes:
+            assert bool(node.op._c_simd_task(node)) == has_simd
+
+    @pytest.mark.skipif(
+        not pytensor.config.cxx,
+        reason="G++ not available, so we need to skip this test.",
+    )
+    def test_simd_c_static_shape(self):
+        # With static shapes, the flat SIMD loop of make_loop replaces the
+        # generic contiguous loop of Elemwise, instead of being nested in it
+        x = tensor(dtype="float64", shape=(7,))
+        y = tensor(dtype="float64", shape=(7,))
+        node = (x + y).owner
+        code = node.op.c_code(
+            node,
+            "node",
+            ["x", "y"],
+            ["z"],
+            dict(fail="FAIL;", failure_var="__failure", id=0),
+        )
+        assert "SIMD_TOTAL" in code
+        assert "All output have the same size" not in code
+
+        # Without SIMD instructions, only the generic contiguous loop is used
+        node = maximum(x, y).owner
+        code = node.op.c_code(
+            node,
+            "node",
+            ["x", "y"],
+            ["z"],
+            dict(fail="FAIL;", failure_var="__failure", id=0),
+        )
+        assert "All output have the same size" in code
+        assert "npy_intp TOTAL" not in code
+
+        f = pytensor.function([x, y], [x + y, maximum(x, y)], mode=Mode(linker="c"))
+        rng = np.random.default_rng(utt.fetch_seed())
+        x_val = rng.random(7)
+        y_val = rng.random(14)[::2]
+        for res, exp_res in zip(
+            f(x_val, y_val), [x_val + y_val, np.maximum(x_val, y_val)]
+        ):
+            utt.assert_allclose(res, exp_res)
+
+    @pytest.mark.parametrize("dtype", discrete_dtypes)
+    def test_simd_c_integers_div(self, dtype):
+        # There are no SIMD integer divisions, and the true divisions of
+        # integers give floats
+        assert make_simd_task("div", f"npy_{dtype}") is None
+        x = vector("x", dtype=dtype)
+        for out in [true_div(x, x[::-1]), int_div(x, x[::-1])]:
+            assert not out.owner.op._c_simd_task(out.owner)
+
+    def test_static_shape_c_code(self):
+        # The static lengths of the output are the bounds of the loops used
+        # when it is C-contiguous
+        x = tensor(dtype="float64", shape=(None, 3, 5))
+        y = tensor(dtype="float64", shape=(None, None, 5))
+        node = (x * y).owner
+        code = node.op.c_code(
+            node,
+            "node",
+            ["x", "y"],
+            ["z"],
+            dict(fail="FAIL;", failure_var="__failure", id=0),
+        )
+        assert "ITER_0<init_totals[0];" in code
+        assert "ITER_1<3;" in code
+        assert "ITER_2<5;" in code
+        assert "static length" in code
+        # The static loops already handle the C-contiguous outputs
+        assert "z_perm[0] = 0;" not in code
+
+        # Lengths of 1 aren't worth it
+        x = tensor(dtype="float64", shape=(None, 1))
+        y = tensor(dtype="float64", shape=(None, 1))
+        node = (x * y).owner
+        code = node.op.c_code(
+            node,
+            "node",
+            ["x", "y"],
+            ["z"],
+            dict(fail="FAIL;", failure_var="__failure", id=0),
+        )
+        assert "ITER_1<1;" not in code
+        assert "static length" not in code
+        assert "z_perm[0] = 0;" in code
+
 
 def test_not_implemented_elemwise_grad():
     # Regression test for unimplemented gradient in an Elemwise Op.
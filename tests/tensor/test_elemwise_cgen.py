@@ -0,0 +1,374 @@
+import numpy as np
+import pytest
+
+import pytensor
+import pytensor.scalar as aes
+from pytensor.compile.mode import Mode
+from pytensor.configdefaults import config
+from pytensor.graph.basic import Apply
+from pytensor.graph.fg import FunctionGraph
+from pytensor.link.c.basic import CLinker
+from pytensor.link.c.op import OpenMPOp
+from pytensor.tensor.basic import as_tensor_variable
+from pytensor.tensor.elemwise import Elemwise
+from pytensor.tensor.elemwise_cgen import (
+    TILE,
+    _make_loop_cached,
+    _make_reordered_loop_cached,
+    make_alloc,
+    make_checks,
+    make_declare,
+    make_loop,
+    make_loop_fused,
+)
+from pytensor.tensor.type import TensorType, matrix, tensor3, vector
+
+
+class LoopOp(OpenMPOp):
+    """Compute `z` from `x` and `y` elementwise, with the loops of `elemwise_cgen`.
+
+    Each task is a piece of C code executed in the inner-most loop, formatted
+    with the names `x`, `y` and `z` of the variables and their C `dtype`.
+    Several tasks are fused with `make_loop_fused`, and a task can declare
+    variables used by the following ones. `fn` computes `z` with NumPy.
+
+    The dimensions of length 1 of the static shapes of the inputs are
+    broadcasted, like in `Elemwise`.
+
+    """
+
+    __props__ = ("tasks", "fn", "allow_runtime_broadcast", "openmp")
+
+    def __init__(self, tasks, fn, allow_runtime_broadcast=False, openmp=False):
+        super().__init__(openmp=openmp)
+        self.tasks = tuple(tasks)
+        self.fn = fn
+        self.allow_runtime_broadcast = allow_runtime_broadcast
+
+    def make_node(self, x, y):
+        x = as_tensor_variable(x)
+        y = as_tensor_variable(y)
+        return Apply(self, [x, y], [TensorType(x.dtype, shape=(None,) * x.ndim)()])
+
+    def perform(self, node, inputs, output_storage):
+        output_storage[0][0] = np.asarray(self.fn(*inputs), dtype=node.inputs[0].dtype)
+
+    def c_code_cache_version(self):
+        return (3,)
+
+    def c_code(self, node, name, inames, onames, sub):
+        (x, y), (z,) = inames, onames
+        dtype = node.inputs[0].type.dtype_specs()[1]
+        orders = [
+            [s == 1 and "x" or i for i, s in enumerate(inp.type.shape)]
+            for inp in node.inputs
+        ]
+        order = list(range(node.outputs[0].type.ndim))
+        sub = dict(sub, lv0=x, lv1=y, lv2=z, olv=z)
+
+        outer_tasks = [("", "")] * (len(order) - 1)
+        list_of_loop_tasks = [
+            outer_tasks + [("", task.format(x=x, y=y, z=z, dtype=dtype)), ""]
+            for task in self.tasks
+        ]
+
+        return "\n".join(
+            [
+                make_declare([*orders, order], [dtype] * 3, sub),
+                make_checks(
+                    orders,
+                    [dtype] * 2,
+                    sub,
+                    allow_runtime_broadcast=self.allow_runtime_broadcast,
+                ),
+                make_alloc(orders, dtype, sub),
+                make_checks([order], [dtype], dict(sub, lv0=z)),
+                make_loop_fused(
+                    [*orders, order],
+                    [dtype] * 3,
+                    list_of_loop_tasks,
+                    sub,
+                    openmp=self.openmp,
+                ),
+            ]
+        )
+
+
+def add(x, y):
+    return x + y
+
+
+def add_mul(x, y):
+    return (x + y) * y
+
+
+# Compute `x + y`, broadcasting the dimensions of length 1 at runtime
+runtime_broadcast_add = LoopOp(
+    ["{z}_i = {x}_i + {y}_i;"], add, allow_runtime_broadcast=True
+)
+# Compute `(x + y) * y` in a single loop, with an intermediate C variable
+fused_add_mul = LoopOp(
+    ["{dtype} tmp = {x}_i + {y}_i;", "{z}_i = tmp * {y}_i;"], add_mul
+)
+
+
+def x2_sub_y(x, y):
+    return 2 * x - y
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+@pytest.mark.parametrize(
+    "x_shape, y_shape",
+    [((3, 4), (3, 4)), ((3, 1), (1, 4)), ((1, 4), (3, 4)), ((0, 1), (1, 4))],
+)
+def test_make_checks_runtime_broadcast(x_shape, y_shape):
+    x = matrix("x")
+    y = matrix("y")
+    f = pytensor.function([x, y], runtime_broadcast_add(x, y), mode="FAST_RUN")
+
+    rng = np.random.default_rng(42)
+    a = rng.random(x_shape).astype(x.dtype)
+    b = rng.random(y_shape).astype(y.dtype)
+    np.testing.assert_allclose(f(a, b), a + b)
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+def test_make_checks_runtime_broadcast_mismatch():
+    x = matrix("x")
+    y = matrix("y")
+    f = pytensor.function([x, y], runtime_broadcast_add(x, y), mode="FAST_RUN")
+
+    a = np.ones((3, 4), dtype=x.dtype)
+    b = np.ones((2, 4), dtype=y.dtype)
+    with pytest.raises(ValueError, match="Input dimension mismatch"):
+        f(a, b)
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+def test_make_loop_fused():
+    x = matrix("x")
+    y = matrix("y")
+    f = pytensor.function([x, y], fused_add_mul(x, y), mode="FAST_RUN")
+
+    rng = np.random.default_rng(42)
+    a = rng.random((5, 6)).astype(x.dtype)
+    b = rng.random((5, 6)).astype(x.dtype)
+    np.testing.assert_allclose(f(a, b), (a + b) * b)
+    # Non-contiguous inputs
+    np.testing.assert_allclose(
+        f(a[:, ::2], b[::-1, 1::2]), (a[:, ::2] + b[::-1, 1::2]) * b[::-1, 1::2]
+    )
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+@pytest.mark.parametrize("openmp", [False, True])
+@pytest.mark.parametrize(
+    "y_static_shape, x_val, y_val",
+    [
+        # Non-contiguous inputs
+        ((None, None, None), lambda r: r[:4, ::2, 1:7], lambda r: r[::2, 5:, ::3]),
+        # Broadcasted inputs
+        ((None, 1, None), lambda r: r[:4, ::2, 1:7], lambda r: r[::2, :1, ::3]),
+        ((1, 1, None), lambda r: r[:4, ::2, 1:7], lambda r: r[:1, :1, ::3]),
+        # Negative strides
+        (
+            (None, None, None),
+            lambda r: r[3::-1, ::-2, 6:0:-1],
+            lambda r: r[:4, 4::-1, :6],
+        ),
+        # Zero strides
+        (
+            (None, None, None),
+            lambda r: r[:4, :5, :6],
+            lambda r: np.broadcast_to(r[0, 0, :6], (4, 5, 6)),
+        ),
+        # Dimensions of length 0 and 1
+        ((None, None, None), lambda r: r[:4, :0, :6], lambda r: r[4:, :0, :6]),
+        ((None, 1, None), lambda r: r[:4, :0, :6], lambda r: r[4:, :1, :6]),
+        ((None, None, None), lambda r: r[:1, :5, :1], lambda r: r[1:2, ::2, 2:3]),
+    ],
+)
+def test_make_loop(openmp, y_static_shape, x_val, y_val):
+    x = tensor3("x")
+    y = TensorType(x.dtype, shape=y_static_shape)("y")
+    op = LoopOp(["{z}_i = 2 * {x}_i - {y}_i;"], x2_sub_y, openmp=openmp)
+    # The loops are run in parallel regardless of their size
+    with config.change_flags(openmp_elemwise_minsize=0):
+        f = pytensor.function([x, y], op(x, y), mode="FAST_RUN")
+
+    r = np.random.default_rng(42).random((8, 10, 18)).astype(x.dtype)
+    a, b = x_val(r), y_val(r)
+    np.testing.assert_allclose(f(a, b), 2 * a - b)
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+def test_make_loop_tiles():
+    a, b, c = (aes.float64(name) for name in "abc")
+    op = Elemwise(aes.Composite([a, b, c], [(a + b) * c]))
+    x, y, z = (vector(name, dtype="float64") for name in "xyz")
+    out = op(x, y, z)
+    # Four contiguous arrays of the same dtype are processed by tiles
+    code = out.owner.op.c_code(
+        out.owner,
+        "node",
+        ["x", "y", "z"],
+        ["w"],
+        {"fail": "", "failure_var": "__failure", "id": 0},
+    )
+    assert f"TILE_START+={TILE}" in code
+    # But not the three arrays of a binary operation
+    out_add_mul = fused_add_mul(x, y)
+    code = out_add_mul.owner.op.c_code(
+        out_add_mul.owner, "node", ["x", "y"], ["z"], {"fail": ""}
+    )
+    assert "TILE_START" not in code
+    f = pytensor.function([x, y, z], out, mode=Mode(linker="c", optimizer=None))
+
+    rng = np.random.default_rng(42)
+    for n in [0, 1, TILE - 1, TILE, TILE + 1, 3 * TILE + 5, 1003]:
+        d = rng.random(n)
+        e = rng.random(n)
+        g = rng.random(n)
+        np.testing.assert_allclose(f(d, e, g), (d + e) * g)
+        # The tiles are only used on contiguous arrays
+        np.testing.assert_allclose(f(d[::-1], e, g), (d[::-1] + e) * g)
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+def test_make_alloc_reuse():
+    x = matrix("x")
+    y = matrix("y")
+    thunk, inputs, outputs = (
+        CLinker().accept(FunctionGraph([x, y], [x + y])).make_thunk()
+    )
+
+    rng = np.random.default_rng(42)
+    previous = None
+    for shape in [(3, 4), (3, 4), (5, 2), (5, 2), (2, 3)]:
+        a = rng.random(shape).astype(x.dtype)
+        b = rng.random(shape).astype(y.dtype)
+        inputs[0].storage[0] = a
+        inputs[1].storage[0] = b
+        thunk()
+        out = outputs[0].storage[0]
+        np.testing.assert_allclose(out, a + b)
+        if previous is not None and previous.shape == shape:
+            # The output of the previous call is reused
+            assert out is previous
+        previous = out
+
+    # An output that isn't writeable is neither reused nor resized
+    for shape in [(2, 3), (3, 3)]:
+        buffer = np.zeros(shape, dtype=x.dtype)
+        buffer.flags.writeable = False
+        outputs[0].storage[0] = buffer
+        thunk()
+        assert outputs[0].storage[0] is not buffer
+        assert buffer.shape == shape and not buffer.any()
+        np.testing.assert_allclose(outputs[0].storage[0], a + b)
+
+
+@pytest.mark.skipif(
+    not pytensor.config.cxx, reason="G++ not available, so we need to skip this test."
+)
+def test_make_alloc_fortran():
+    x = matrix("x")
+    y = matrix("y")
+    # Elemwise allocates its outputs in Fortran order when all its inputs are
+    # in Fortran order, and LoopOp always in C order.
+    outs = [x + y, fused_add_mul(x, y)]
+    thunk, inputs, outputs = CLinker().accept(FunctionGraph([x, y], outs)).make_thunk()
+
+    rng = np.random.default_rng(42)
+    a = rng.random((3, 4)).astype(x.dtype)
+    b = rng.random((3, 4)).astype(y.dtype)
+    for a_val, b_val, f_contiguous in [
+        (a, b, False),
+        (np.asfortranarray(a), b, False),
+        (np.asfortranarray(a), np.asfortranarray(b), True),
+    ]:
+        inputs[0].storage[0] = a_val
+        inputs[1].storage[0] = b_val
+        thunk()
+        elemwise_out, loop_out = outputs[0].storage[0], outputs[1].storage[0]
+        np.testing.assert_allclose(elemwise_out, a + b)
+        np.testing.assert_allclose(loop_out, (a + b) * b)
+        assert elemwise_out.flags.f_contiguous == f_contiguous
+        assert elemwise_out.flags.c_contiguous != f_contiguous
+        assert loop_out.flags.c_contiguous
+
+    # A Fortran output of the right shape is reused
+    buffer = np.asfortranarray(np.zeros((3, 4), dtype=x.dtype))
+    outputs[0].storage[0] = buffer
+    thunk()
+    assert outputs[0].storage[0] is buffer
+    np.testing.assert_allclose(buffer, a + b)
+
+
+def test_make_loop_fused_levels():
+    with pytest.raises(ValueError, match="same number of levels"):
+        make_loop_fused(
+            [[0]], ["double"], [[("", ""), ""], [("", ""), ("", ""), ""]], {"lv0": "x"}
+        )
+
+
+def test_make_loop_cache():
+    sub = dict(lv0="x", lv1="y", lv2="z", fail="FAIL;")
+    tasks = [("", ""), ("", "z_i = x_i + y_i;"), ""]
+    code = make_loop([[0, 1]] * 3, ["double"] * 3, tasks, sub)
+    # Equivalent arguments, up to the unused keys of sub, hit the cache
+    hits = _make_loop_cached.cache_info().hits
+    assert (
+        make_loop(((0, 1),) * 3, ("double",) * 3, tuple(tasks), dict(sub, id=3)) == code
+    )
+    assert _make_loop_cached.cache_info().hits == hits + 1
+    # So do other names of the variables and failure codes
+    other_sub = dict(lv0="a", lv1="b", lv2="max", fail="FAIL_2;")
+    other_tasks = [("", ""), ("", "max_i = a_i + b_i;"), ""]
+    other_code = make_loop([[0, 1]] * 3, ["double"] * 3, other_tasks, other_sub)
+    assert _make_loop_cached.cache_info().hits == hits + 2
+    assert "max_i = a_i + b_i;" in other_code
+    assert "y_iter" not in other_code and "z_i" not in other_code
+
+    with config.change_flags(openmp_elemwise_minsize=123):
+        assert ">=123)" in make_loop(
+            [[0, 1]] * 3, ["double"] * 3, tasks, sub, openmp=True
+        )
+    with config.change_flags(openmp_elemwise_minsize=456):
+        assert ">=456)" in make_loop(
+            [[0, 1]] * 3, ["double"] * 3, tasks, sub, openmp=True
+        )
+
+
+def test_elemwise_c_code_cache():
+    x, y = matrix("x"), matrix("y")
+    nodes = [(x + y).owner, (y + x).owner]
+    hits = _make_reordered_loop_cached.cache_info().hits
+    codes = [
+        node.op.c_code(
+            node,
+            f"node_{i}",
+            [f"in{i}_0", f"in{i}_1"],
+            [f"out{i}"],
+            dict(fail=f"FAIL_{i};", failure_var="__failure", id=i),
+        )
+        for i, node in enumerate(nodes)
+    ]
+    # Both nodes only differ by the names of their variables
+    assert _make_reordered_loop_cached.cache_info().hits > hits
+    for i, code in enumerate(codes):
+        assert f"out{i}_i = in{i}_0_i + in{i}_1_i;" in code
+        assert f"FAIL_{i};" in code
+        assert "\x00" not in code